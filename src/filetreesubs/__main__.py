@@ -28,7 +28,12 @@
 
 from __future__ import annotations
 
+import concurrent.futures
+import glob
+import os
+import os.path
 import sys
+import time
 
 import doit.cmd_base
 import doit.doit_cmd
@@ -36,7 +41,12 @@ import doit.loader
 import doit.reporter
 import yaml
 
+import filetreesubs.compress
+import filetreesubs.filters
+import filetreesubs.journal
+import filetreesubs.store
 import filetreesubs.subs
+import filetreesubs.utils
 
 
 class FileTreeSubsTaskLoader(doit.cmd_base.TaskLoader2):
@@ -74,10 +84,83 @@ class FileTreeSubsDoitCmd(doit.doit_cmd.DoitMain):
         self.task_loader = self.TASK_LOADER(file_tree_subs)
 
     def run(self, all_args=None):
-        return super().run(["run"])
+        start = time.monotonic()
+        result = super().run(["run"])
+        if not self.file_tree_subs.close() and result == 0:
+            result = 1
+        if self.file_tree_subs.print_stats:
+            self.file_tree_subs.stats.add("elapsed_seconds", time.monotonic() - start)
+            sys.stderr.write(f"Statistics:\n{self.file_tree_subs.stats.format()}")
+        return result
 
 
-def _load_config(file_tree_subs, config):
+def _get_io_pipeline_config(io_pipeline):
+    """Convert the `io_pipeline` option to keyword arguments for `IOPipeline`."""
+    if io_pipeline is None or io_pipeline is False:
+        return None
+    if io_pipeline is True:
+        return {}
+    if not isinstance(io_pipeline, dict):
+        raise RuntimeError("io_pipeline must be a boolean or a dict!")
+    return {
+        key: int(io_pipeline[key])
+        for key in ("readers", "writers", "max_inflight_bytes")
+        if key in io_pipeline
+    }
+
+
+def _get_compress_config(compress):
+    """Convert the `compress` option to keyword arguments for `Compressor`."""
+    if compress is None or compress is False:
+        return None
+    if compress is True:
+        compress = {}
+    if not isinstance(compress, dict):
+        raise RuntimeError("compress must be a boolean or a dict!")
+    result = {
+        "patterns": compress.get("patterns", filetreesubs.compress.DEFAULT_PATTERNS),
+        "formats": compress.get("formats", filetreesubs.compress.DEFAULT_FORMATS),
+    }
+    if "workers" in compress:
+        result["workers"] = int(compress["workers"])
+    filetreesubs.compress.check_formats(result["formats"])
+    return result
+
+
+def _get_store_path(dedupe):
+    """Convert the `dedupe` option to the path of the content-addressed store."""
+    if dedupe is None or dedupe is False:
+        return None
+    if dedupe is True:
+        return filetreesubs.store.DEFAULT_PATH
+    if not isinstance(dedupe, dict):
+        raise RuntimeError("dedupe must be a boolean or a dict!")
+    return dedupe.get("store", filetreesubs.store.DEFAULT_PATH)
+
+
+def _get_journal_config(journal):
+    """Convert the `journal` option to keyword arguments for `Journal`."""
+    if journal is None or journal is False:
+        return None
+    if isinstance(journal, str):
+        journal = {"path": journal}
+    if not isinstance(journal, dict) or "path" not in journal:
+        raise RuntimeError("journal must be a filename or a dict with a path!")
+    result = {
+        "path": journal["path"],
+        "fmt": journal.get("format", "jsonl"),
+        "digest": bool(journal.get("digest", True)),
+    }
+    if result["fmt"] not in filetreesubs.journal.FORMATS:
+        known_formats = ", ".join(filetreesubs.journal.FORMATS)
+        raise RuntimeError(
+            f"Unknown journal format '{result['fmt']}'! Known formats: {known_formats}"
+        )
+    return result
+
+
+def _load_config(file_tree_subs, config):  # noqa: C901
+    # pylint:disable=too-many-branches
     if "source" in config:
         file_tree_subs.source = config["source"]
     if "destination" in config:
@@ -94,42 +177,211 @@ def _load_config(file_tree_subs, config):
         file_tree_subs.doit_config_update = config["doit_config"]
     if "encoding" in config:
         file_tree_subs.encoding = config["encoding"]
+    if "io_pipeline" in config:
+        file_tree_subs.io_pipeline_config = _get_io_pipeline_config(
+            config["io_pipeline"]
+        )
+    if "compress" in config:
+        file_tree_subs.compress_config = _get_compress_config(config["compress"])
+    if "dedupe" in config:
+        file_tree_subs.store_path = _get_store_path(config["dedupe"])
+    if "include" in config or "exclude" in config or "preserve" in config:
+        file_tree_subs.path_filter = filetreesubs.filters.PathFilter(
+            include=config.get("include"),
+            exclude=config.get("exclude"),
+            preserve=config.get("preserve"),
+        )
+    if "journal" in config:
+        file_tree_subs.journal_config = _get_journal_config(config["journal"])
+    if "stats" in config:
+        file_tree_subs.print_stats = bool(config["stats"])
+
+
+_CONTENT_CACHE = filetreesubs.utils.ContentCache()
+
+_DEFAULT_DEP_FILE = ".doit.db"
+
+
+def _expand_config_filenames(arg):
+    """Expand a command line argument to a list of configuration file names.
+
+    Directories are expanded to all ``.yaml`` and ``.yml`` files in them,
+    and glob patterns are expanded to the matching files.
+    """
+    if os.path.isdir(arg):
+        result = sorted(
+            glob.glob(os.path.join(glob.escape(arg), "*.yaml"))
+            + glob.glob(os.path.join(glob.escape(arg), "*.yml"))
+        )
+        if not result:
+            raise RuntimeError(f"No configuration files found in '{arg}'!")
+        return result
+    if any(char in arg for char in "*?["):
+        result = sorted(glob.glob(arg))
+        if not result:
+            raise RuntimeError(f"No configuration files match '{arg}'!")
+        return result
+    return [arg]
+
+
+def _parse_jobs(value):
+    """Parse the value of the ``--jobs`` argument."""
+    try:
+        jobs = int(value)
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid number of jobs '{value}'!") from exc
+    if jobs < 1:
+        raise RuntimeError(f"Invalid number of jobs '{value}'!")
+    return jobs
+
+
+def _parse_args(args):
+    """Parse command line arguments. Returns list of config file names and number of jobs."""
+    config_filenames = []
+    jobs = 1
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in ("-j", "--jobs") or arg.startswith("--jobs="):
+            if "=" in arg:
+                value = arg.split("=", 1)[1]
+            elif args:
+                value = args.pop(0)
+            else:
+                raise RuntimeError(f"Argument '{arg}' needs a value!")
+            jobs = _parse_jobs(value)
+        elif arg.startswith("-"):
+            raise RuntimeError(f"Unknown argument '{arg}'!")
+        else:
+            for config_filename in _expand_config_filenames(arg):
+                if config_filename not in config_filenames:
+                    config_filenames.append(config_filename)
+    if not config_filenames:
+        config_filenames.append("filetreesubs-config.yaml")
+    return config_filenames, jobs
+
+
+def _read_config(config_filename):
+    """Load and parse the configuration file `config_filename`."""
+    with open(config_filename, "rb") as file:
+        try:
+            return yaml.safe_load(file)
+        except Exception as exc:  # pylint:disable=broad-exception-caught
+            raise RuntimeError(
+                "Failure while parsing '{0}':\n{1}".format(
+                    config_filename,
+                    "\n".join(["  " + line for line in str(exc).split("\n")]),
+                )
+            ) from exc
+
 
+def _get_dep_file(config):
+    """Determine the doit dependency database used by a configuration."""
+    dep_file = _DEFAULT_DEP_FILE
+    if isinstance(config, dict) and isinstance(config.get("doit_config"), dict):
+        dep_file = config["doit_config"].get("dep_file", dep_file)
+    return os.path.abspath(dep_file)
 
-def main(args=None):  # noqa: C901
+
+def _run_config(config):
+    """Execute the substitutions for one loaded configuration. Returns exit code."""
+    try:
+        file_tree_subs = filetreesubs.subs.FileTreeSubs(content_cache=_CONTENT_CACHE)
+        _load_config(file_tree_subs, config)
+        return FileTreeSubsDoitCmd(file_tree_subs).run()
+    except SystemExit as exc:
+        return exc.code if isinstance(exc.code, int) else 1
+    except Exception as exc:  # pylint:disable=broad-exception-caught
+        sys.stderr.write(f"{exc}\n")
+        return 1
+
+
+def _run_config_group(configs):
+    """Execute a list of ``(config_filename, config)`` tuples sequentially.
+
+    Returns a list of ``(config_filename, exit_code)`` tuples.
+    """
+    return [
+        (config_filename, _run_config(config)) for config_filename, config in configs
+    ]
+
+
+def _run_batch(configs, jobs):
+    """Execute all configurations in `configs`.
+
+    Configurations sharing a dependency database are executed sequentially,
+    since doit cannot use one database from several processes at the same
+    time. If `jobs` is larger than 1, these groups are executed concurrently
+    in a process pool.
+
+    Returns a dictionary mapping config file names to exit codes.
+    """
+    groups = {}
+    for config_filename, config in configs:
+        groups.setdefault(_get_dep_file(config), []).append((config_filename, config))
+    if jobs > 1:
+        for dep_file, group in groups.items():
+            if len(group) > 1:
+                sys.stderr.write(
+                    f"Note: {len(group)} configurations use the dependency database"
+                    f" '{dep_file}' and are run one after another. Set different"
+                    " doit_config.dep_file values to run them concurrently.\n"
+                )
+    results = {}
+    if jobs <= 1 or len(groups) <= 1:
+        for group in groups.values():
+            results.update(_run_config_group(group))
+        return results
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=min(jobs, len(groups))
+    ) as executor:
+        for group_results in executor.map(_run_config_group, groups.values()):
+            results.update(group_results)
+    return results
+
+
+def main(args=None):
     """The main CLI program."""
     if args is None:
         args = sys.argv[1:]
     try:
         # Parse arguments
-        config_filename = "filetreesubs-config.yaml"
-        if len(args) >= 1:
-            config_filename = args[0]
-        for arg in args[1:]:
-            raise RuntimeError(f"Unknown argument '{arg}'!")
+        config_filenames, jobs = _parse_args(args)
 
-        # Load configuration
-        with open(config_filename, "rb") as file:
-            try:
-                config = yaml.safe_load(file)
-            except Exception as exc:  # pylint:disable=broad-exception-caught
-                raise RuntimeError(
-                    "Failure while parsing '{0}':\n{1}".format(
-                        config_filename,
-                        "\n".join(["  " + line for line in str(exc).split("\n")]),
-                    )
-                ) from exc
-
-        # Use configuration
-        file_tree_subs = filetreesubs.subs.FileTreeSubs()
-        _load_config(file_tree_subs, config)
-
-        # Execute substitution
-        return FileTreeSubsDoitCmd(file_tree_subs).run()
+        # Single configuration
+        if len(config_filenames) == 1:
+            config = _read_config(config_filenames[0])
+            file_tree_subs = filetreesubs.subs.FileTreeSubs()
+            _load_config(file_tree_subs, config)
+            return FileTreeSubsDoitCmd(file_tree_subs).run()
     except Exception as exc:  # pylint:disable=broad-exception-caught
         sys.stderr.write(f"{exc}\n")
         return 1
 
+    # Batch of configurations
+    results = {}
+    configs = []
+    for config_filename in config_filenames:
+        try:
+            config = _read_config(config_filename)
+        except Exception as exc:  # pylint:disable=broad-exception-caught
+            sys.stderr.write(f"{exc}\n")
+            results[config_filename] = 1
+            continue
+        configs.append((config_filename, config))
+    results.update(_run_batch(configs, jobs))
+
+    # Report per-config results
+    exit_code = 0
+    for config_filename in config_filenames:
+        result = results[config_filename]
+        if result == 0:
+            sys.stderr.write(f"{config_filename}: ok\n")
+        else:
+            sys.stderr.write(f"{config_filename}: failed with exit code {result}\n")
+            exit_code = max(exit_code, result)
+    return exit_code
+
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))
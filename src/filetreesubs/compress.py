@@ -0,0 +1,178 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright © 2014—2023 Felix Fontein.
+#
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Precompressed sidecar files"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import gzip
+import os
+import re
+
+from filetreesubs import utils
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _compress_gz(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _compress_br(data):
+    return brotli.compress(data)
+
+
+def _compress_zst(data):
+    return zstandard.ZstdCompressor(level=19).compress(data)
+
+
+FORMATS = {
+    "gz": (_compress_gz, lambda: True, None),
+    "br": (_compress_br, lambda: brotli is not None, "brotli"),
+    "zst": (_compress_zst, lambda: zstandard is not None, "zstandard"),
+}
+
+
+DEFAULT_PATTERNS = [
+    r".*\.html?",
+    r".*\.css",
+    r".*\.js",
+    r".*\.json",
+    r".*\.svg",
+    r".*\.txt",
+    r".*\.xml",
+]
+
+DEFAULT_FORMATS = ["gz"]
+
+
+def check_formats(formats):
+    """Make sure that all compression formats in `formats` are known and available."""
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise RuntimeError(
+                f"Unknown compression format '{fmt}'! Known formats: {', '.join(FORMATS)}"
+            )
+        _, is_available, requirement = FORMATS[fmt]
+        if not is_available():
+            raise RuntimeError(
+                f"Compression format '{fmt}' needs the Python package '{requirement}'!"
+            )
+
+
+class Compressor:
+    # pylint:disable=too-many-instance-attributes
+    """Creates compressed sidecar files (like ``index.html.gz``) in a thread pool."""
+
+    def __init__(  # pylint:disable=too-many-arguments
+        self, patterns, formats, workers=4, *, stats=None, journal=None
+    ):
+        check_formats(formats)
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.formats = list(formats)
+        self.workers = workers
+        self.stats = stats if stats is not None else utils.Statistics()
+        self.journal = journal
+        self.errors = []
+        self._executor = None
+        self._pid = os.getpid()
+
+    def get_formats(self, filename):
+        """Return the compression formats for the relative file name `filename`.
+
+        Patterns must match the whole file name. Files which already are
+        compressed sidecars never get sidecars of their own.
+        """
+        if filename.endswith(tuple(f".{fmt}" for fmt in FORMATS)):
+            return []
+        if any(pattern.fullmatch(filename) for pattern in self.patterns):
+            return list(self.formats)
+        return []
+
+    def compress(self, filename, formats, data=None):
+        """Create sidecars of the given formats for `filename` in the current thread."""
+        sidecar = filename
+        try:
+            if data is None:
+                data = utils.get_bytes(filename)
+            stat = os.stat(filename)
+            for fmt in formats:
+                sidecar = f"{filename}.{fmt}"
+                compressed = FORMATS[fmt][0](data)
+                existed = self.journal is not None and os.path.lexists(sidecar)
+                utils.write_bytes(sidecar, compressed)
+                os.utime(sidecar, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                if self.journal is not None:
+                    self.journal.record_write(sidecar, compressed, existed)
+                self.stats.add("compress_files")
+                self.stats.add("compress_bytes_in", len(data))
+                self.stats.add("compress_bytes_out", len(compressed))
+        except Exception as exc:  # pylint:disable=broad-exception-caught
+            # Remove all sidecars so that the next run creates them again
+            for fmt in formats:
+                try:
+                    os.unlink(f"{filename}.{fmt}")
+                    if self.journal is not None:
+                        self.journal.record_delete(f"{filename}.{fmt}")
+                except Exception:  # pylint:disable=broad-exception-caught
+                    pass
+            self.errors.append(("compressing", sidecar, exc))
+
+    def submit(self, filename, formats, data=None):
+        """Create sidecars of the given formats for `filename`.
+
+        If `data` is not provided, the content of `filename` is read.
+        """
+        if not formats:
+            return
+        if os.getpid() != self._pid:
+            # Running in a process spawned by doit; these do not wait for threads
+            self.compress(filename, formats, data)
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix="filetreesubs-compress"
+            )
+        self._executor.submit(self.compress, filename, formats, data)
+
+    def close(self):
+        """Wait for all sidecars to be written.
+
+        Returns the list of errors as ``(phase, filename, exception)`` tuples.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        return self.errors
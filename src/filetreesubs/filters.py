@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright © 2014—2023 Felix Fontein.
+#
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Include, exclude and preserve rules for walking file trees"""
+
+from __future__ import annotations
+
+import fnmatch
+import os
+import re
+
+
+def _compile_rule(rule, option):
+    """Compile a rule. Strings are regular expressions, dicts can also specify globs."""
+    if isinstance(rule, str):
+        return re.compile(rule)
+    if isinstance(rule, dict) and len(rule) == 1:
+        if "regex" in rule:
+            return re.compile(rule["regex"])
+        if "glob" in rule:
+            return re.compile(fnmatch.translate(rule["glob"]))
+    raise RuntimeError(
+        # pylint:disable-next=line-too-long
+        f"Cannot interpret {option} rule '{rule}'! Must be a string, or a dict with 'regex' or 'glob'."
+    )
+
+
+def _matches(rules, path):
+    """Check whether one of `rules` matches the relative path `path`."""
+    if os.sep != "/":
+        path = path.replace(os.sep, "/")
+    return any(rule.fullmatch(path) for rule in rules)
+
+
+class PathFilter:
+    """Decides which files and directories are synchronized.
+
+    All rules must match the whole path relative to the source or destination
+    directory, using `/` as the separator. Directories matched by `exclude`
+    are not walked at all. If `include` rules are present, only files of the
+    source matching one of them are synchronized. Files and directories in
+    the destination matched by `exclude` or `preserve` are never removed.
+    """
+
+    def __init__(self, include=None, exclude=None, preserve=None):
+        self.include = [_compile_rule(rule, "include") for rule in include or []]
+        self.exclude = [_compile_rule(rule, "exclude") for rule in exclude or []]
+        self.preserve = [_compile_rule(rule, "preserve") for rule in preserve or []]
+
+    def is_directory_excluded(self, path):
+        """Check whether the directory with relative path `path` should not be walked."""
+        return _matches(self.exclude, path)
+
+    def is_file_excluded(self, path):
+        """Check whether the file with relative path `path` should not be synchronized."""
+        if _matches(self.exclude, path):
+            return True
+        return bool(self.include) and not _matches(self.include, path)
+
+    def is_protected(self, path):
+        """Check whether the file or directory `path` in the destination must be kept."""
+        return _matches(self.exclude, path) or _matches(self.preserve, path)
@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright © 2014—2023 Felix Fontein.
+#
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Journal of changes made to the destination tree"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+
+FORMATS = ("jsonl", "nul")
+
+
+def _get_file_digest(filename):
+    """Compute the SHA-256 digest of the file `filename`."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Journal:
+    # pylint:disable=too-many-instance-attributes
+    """Records which files in the destination were created, modified or deleted.
+
+    With format ``jsonl``, every change is written as a JSON object with
+    the keys ``action``, ``path``, ``size`` and ``digest`` on its own line.
+    With format ``nul``, only the paths are written, separated by NUL
+    bytes. Paths are relative to `root`.
+
+    Records are appended to the journal file as they happen, so that
+    processes spawned by doit can add to the journal as well.
+    """
+
+    def __init__(self, path, root, fmt="jsonl", digest=True, stats=None):
+        if fmt not in FORMATS:
+            raise RuntimeError(
+                f"Unknown journal format '{fmt}'! Known formats: {', '.join(FORMATS)}"
+            )
+        self.path = path
+        self.root = root
+        self.format = fmt
+        # Digests are only part of the JSON lines format
+        self.digest = digest and fmt == "jsonl"
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def start(self):
+        """Truncate the journal file."""
+        with self._lock:
+            self._close()
+            self._fd = os.open(
+                self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o666
+            )
+            self._pid = os.getpid()
+
+    def _close(self):
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+
+    def close(self):
+        """Close the journal file."""
+        with self._lock:
+            self._close()
+
+    def _append(self, action, filename, size=None, digest=None):
+        path = os.path.relpath(filename, self.root)
+        if self.format == "nul":
+            record = path.encode("utf-8", "surrogateescape") + b"\0"
+        else:
+            record = (
+                json.dumps(
+                    {"action": action, "path": path, "size": size, "digest": digest}
+                )
+                + "\n"
+            ).encode("utf-8")
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                # Processes spawned by doit append to the journal started by the main process
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+                self._pid = os.getpid()
+            # One write per record, so records of different processes do not mix
+            os.write(self._fd, record)
+        if self.stats is not None:
+            self.stats.add(f"journal_{action}")
+
+    def record_write(self, filename, data=None, existed=False):
+        """Record that `filename` was written with content `data`.
+
+        If `data` is not provided, the file is read to compute its digest.
+        """
+        digest = None
+        if data is None:
+            size = os.path.getsize(filename)
+            if self.digest:
+                digest = _get_file_digest(filename)
+        else:
+            size = len(data)
+            if self.digest:
+                digest = hashlib.sha256(data).hexdigest()
+        if digest is not None:
+            digest = f"sha256:{digest}"
+        self._append("modified" if existed else "created", filename, size, digest)
+
+    def record_delete(self, filename):
+        """Record that `filename` was deleted."""
+        self._append("deleted", filename)
@@ -0,0 +1,234 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright © 2014—2023 Felix Fontein.
+#
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Pipelined file I/O with bounded read-ahead and write-behind"""
+
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+
+from filetreesubs import utils
+
+
+class IOPipeline:
+    # pylint:disable=too-many-instance-attributes
+    """Runs file reads and writes in thread pools.
+
+    Source files are read by a pool of reader threads, their contents are
+    processed by the thread submitting the work (usually doit's main loop),
+    and the results are written by a pool of writer threads. The number of
+    bytes being read, waiting for processing, or being written is bounded
+    by `max_inflight_bytes`; submitting more work blocks until enough bytes
+    have been written.
+
+    Files are written with `write_bytes(destination, data)` and copied
+    with `copy_file(source, destination)`. If reading, processing, writing
+    or copying fails, the destination is removed with
+    `remove_file(destination)`, so that it is re-created by the next run.
+
+    When used from a different process than the one which created the
+    pipeline (for example from doit's multi-process runner), all work is
+    done synchronously.
+    """
+
+    def __init__(  # pylint:disable=too-many-arguments
+        self,
+        readers=4,
+        writers=4,
+        max_inflight_bytes=64 * 1024 * 1024,
+        *,
+        stats=None,
+        write_bytes=utils.write_bytes,
+        copy_file=utils.copy_file,
+        remove_file=os.unlink,
+    ):
+        self.max_inflight_bytes = max_inflight_bytes
+        self.write_bytes = write_bytes
+        self.copy_file = copy_file
+        self.remove_file = remove_file
+        self.stats = stats if stats is not None else utils.Statistics()
+        self.errors = []
+        self._pid = os.getpid()
+        self._readers = concurrent.futures.ThreadPoolExecutor(
+            readers, thread_name_prefix="filetreesubs-read"
+        )
+        self._writers = concurrent.futures.ThreadPoolExecutor(
+            writers, thread_name_prefix="filetreesubs-write"
+        )
+        self._condition = threading.Condition()
+        self._inflight = 0
+        self._pending_reads = collections.deque()
+        self._closed = False
+
+    def _is_foreign_process(self):
+        return os.getpid() != self._pid
+
+    def _notify(self, _future=None):
+        with self._condition:
+            self._condition.notify_all()
+
+    def _release(self, size):
+        with self._condition:
+            self._inflight -= size
+            self._condition.notify_all()
+
+    def _reserve(self, size):
+        """Reserve `size` bytes of the in-flight budget.
+
+        While the budget is exhausted, process finished reads and wait for
+        reads and writes to finish. A single file larger than the budget is
+        admitted once nothing else is in flight.
+        """
+        waited = None
+        while True:
+            self._process_reads()
+            with self._condition:
+                if (
+                    self._inflight == 0
+                    or self._inflight + size <= self.max_inflight_bytes
+                ):
+                    self._inflight += size
+                    self.stats.maximum("io_max_inflight_bytes", self._inflight)
+                    break
+                if waited is None:
+                    waited = time.monotonic()
+                    self.stats.add("io_budget_waits")
+                if not any(future.done() for future, _, _, _, _ in self._pending_reads):
+                    self._condition.wait(0.1)
+        if waited is not None:
+            self.stats.add("io_budget_wait_seconds", time.monotonic() - waited)
+
+    def _record_error(self, phase, destination, exc):
+        """Record that `phase` (reading, processing, writing, copying) failed."""
+        # Remove a possibly partially written or outdated file
+        try:
+            self.remove_file(destination)
+        except Exception:  # pylint:disable=broad-exception-caught
+            pass
+        self.errors.append((phase, destination, exc))
+
+    def _write(self, destination, data, on_written):
+        try:
+            utils.ensure_file_directory_exists(destination)
+            self.write_bytes(destination, data)
+            self.stats.add("io_bytes_written", len(data))
+            if on_written is not None:
+                on_written(destination, data)
+        except Exception as exc:  # pylint:disable=broad-exception-caught
+            self._record_error("writing", destination, exc)
+        finally:
+            self._release(len(data))
+
+    def _copy(self, source, destination, size, on_written):
+        try:
+            self.copy_file(source, destination)
+            self.stats.add("io_bytes_written", size)
+            if on_written is not None:
+                on_written(destination, None)
+        except Exception as exc:  # pylint:disable=broad-exception-caught
+            self._record_error("copying", destination, exc)
+        finally:
+            self._release(size)
+
+    def _read(self, source):
+        data = utils.get_bytes(source)
+        self.stats.add("io_bytes_read", len(data))
+        return data
+
+    def _process_reads(self, block=False):
+        """Process finished reads in submission order and queue their writes."""
+        while self._pending_reads:
+            future, destination, process, size, on_written = self._pending_reads[0]
+            if not block and not future.done():
+                return
+            self._pending_reads.popleft()
+            phase = "reading"
+            try:
+                data = future.result()
+                phase = "processing"
+                data = process(data)
+            except Exception as exc:  # pylint:disable=broad-exception-caught
+                self._record_error(phase, destination, exc)
+                self._release(size)
+                continue
+            # Replace the reservation for the source by one for the result
+            with self._condition:
+                self._inflight += len(data) - size
+                self.stats.maximum("io_max_inflight_bytes", self._inflight)
+            self._writers.submit(self._write, destination, data, on_written)
+
+    def submit_copy(self, source, destination, on_written=None):
+        """Copy `source` to `destination` in a writer thread.
+
+        If provided, `on_written` is called with `destination` and `None`
+        once the copy is done.
+        """
+        if self._is_foreign_process():
+            self.copy_file(source, destination)
+            if on_written is not None:
+                on_written(destination, None)
+            return
+        size = os.path.getsize(source)
+        self._reserve(size)
+        self._writers.submit(self._copy, source, destination, size, on_written)
+
+    def submit_process(self, source, destination, process, on_written=None):
+        """Read `source` in a reader thread, and write `process(data)` to `destination`.
+
+        `process` is called with the source's content as bytes in the
+        submitting thread and must return bytes. If provided, `on_written`
+        is called with `destination` and the written bytes once they have
+        been written.
+        """
+        if self._is_foreign_process():
+            utils.ensure_file_directory_exists(destination)
+            data = process(utils.get_bytes(source))
+            self.write_bytes(destination, data)
+            if on_written is not None:
+                on_written(destination, data)
+            return
+        size = os.path.getsize(source)
+        self._reserve(size)
+        future = self._readers.submit(self._read, source)
+        future.add_done_callback(self._notify)
+        self._pending_reads.append((future, destination, process, size, on_written))
+
+    def close(self):
+        """Wait for all pending work to finish.
+
+        Returns the list of errors as ``(phase, filename, exception)`` tuples.
+        """
+        if self._closed or self._is_foreign_process():
+            return self.errors
+        self._closed = True
+        self._process_reads(block=True)
+        self._readers.shutdown(wait=True)
+        self._writers.shutdown(wait=True)
+        return self.errors
@@ -0,0 +1,219 @@
+# SPDX-License-Identifier: MIT
+
+# Copyright © 2014—2023 Felix Fontein.
+#
+# Permission is hereby granted, free of charge, to any
+# person obtaining a copy of this software and associated
+# documentation files (the "Software"), to deal in the
+# Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice
+# shall be included in all copies or substantial portions of
+# the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY
+# KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS
+# OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Content-addressed store for output files"""
+
+from __future__ import annotations
+
+import errno
+import hashlib
+import os
+import os.path
+import stat
+import tempfile
+
+from filetreesubs import utils
+
+DEFAULT_PATH = ".filetreesubs-store"
+
+_TEMP_PREFIX = ".tmp-"
+
+
+def _get_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def get_digest(data):
+    """Compute the digest used to store `data`."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ContentStore:
+    """Stores every distinct output content once and hardlinks it into place.
+
+    Blobs are stored under their SHA-256 digest, and are readable by
+    everyone who could read a newly created file. Copies are stored under
+    the digest together with the mode and modification time of their
+    source, so that all copies sharing a blob would have the same metadata
+    anyway. If a hardlink cannot be created (for example because the
+    store is on a different filesystem, or the maximal number of links is
+    reached), the content is written directly instead. Once linking
+    failed because the store is on a different filesystem, the store is
+    no longer used for that filesystem.
+
+    Since all outputs with the same content share one blob, outputs must
+    never be modified in place. A blob whose size no longer matches its
+    digest is replaced, but other in-place modifications are not detected.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, stats=None):
+        self.path = path
+        self.stats = stats if stats is not None else utils.Statistics()
+        self.mode = 0o666 & ~_get_umask()
+        # Maps device IDs of destination directories to whether they are
+        # on the same filesystem as the store
+        self._linkable_devices = {}
+
+    def _get_blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def _get_device(self, destination):
+        """Return the device ID of the directory of `destination`, which must exist."""
+        return os.stat(os.path.dirname(destination) or os.curdir).st_dev
+
+    def _is_linkable(self, device):
+        """Check whether files on the device `device` can be linked from the store."""
+        linkable = self._linkable_devices.get(device)
+        if linkable is None:
+            utils.makedirs(self.path)
+            linkable = os.stat(self.path).st_dev == device
+            self._linkable_devices[device] = linkable
+            if not linkable:
+                self.stats.add("store_unlinkable_devices")
+        return linkable
+
+    def _put(self, blob, data, mode, times):
+        """Write the blob `blob` with content `data`, mode `mode` and times `times`."""
+        directory = os.path.dirname(blob)
+        utils.makedirs(directory)
+        # Write to a temporary file first, so that other threads or
+        # processes never see a partially written blob
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=_TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            # mkstemp() creates files only readable by the owner
+            os.chmod(tmp_name, mode)
+            if times is not None:
+                os.utime(tmp_name, ns=times)
+            os.replace(tmp_name, blob)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except Exception:  # pylint:disable=broad-exception-caught
+                pass
+            raise
+        self.stats.add("store_blobs_written")
+        self.stats.add("store_bytes_written", len(data))
+
+    def _ensure_blob(self, blob, data, mode, times):
+        """Make sure that the blob `blob` with content `data` exists.
+
+        `mode` is the mode of the blob, and `times` is either `None` or the
+        access and modification time in nanoseconds.
+        """
+        try:
+            blob_stat = os.stat(blob)
+        except FileNotFoundError:
+            self._put(blob, data, mode, times)
+            return
+        if blob_stat.st_size != len(data):
+            # The blob was modified in place through one of its links
+            self._put(blob, data, mode, times)
+            self.stats.add("store_blobs_replaced")
+            return
+        if blob_stat.st_mode & 0o7777 != mode:
+            os.chmod(blob, mode)
+        if times is not None and blob_stat.st_mtime_ns != times[1]:
+            os.utime(blob, ns=times)
+        self.stats.add("store_blobs_reused")
+
+    def _link(  # pylint:disable=too-many-arguments
+        self, blob, destination, data, device, *, mode, times=None
+    ):
+        """Link `destination` to the blob `blob`. Returns `False` if that is not possible."""
+        try:
+            os.unlink(destination)
+        except Exception:  # pylint:disable=broad-exception-caught
+            pass
+        # The blob can be pruned by another process before it is linked
+        for _ in range(3):
+            self._ensure_blob(blob, data, mode, times)
+            try:
+                os.link(blob, destination)
+                self.stats.add("store_links")
+                return True
+            except FileNotFoundError:
+                continue
+            except OSError as exc:
+                if exc.errno == errno.EXDEV:
+                    # Bind mounts can have the same device ID as the store
+                    self._linkable_devices[device] = False
+                return False
+        return False
+
+    def write_bytes(self, destination, data, digest=None):
+        """Write `data` to `destination` by linking it from the store.
+
+        `digest` can be provided if the result of ``get_digest(data)`` is
+        already known.
+        """
+        utils.ensure_file_directory_exists(destination)
+        device = self._get_device(destination)
+        if self._is_linkable(device):
+            if digest is None:
+                digest = get_digest(data)
+            blob = self._get_blob_path(digest)
+            if self._link(blob, destination, data, device, mode=self.mode):
+                return
+        utils.write_bytes(destination, data)
+        self.stats.add("store_link_fallbacks")
+
+    def copy_file(self, source, destination):
+        """Copy `source` to `destination` by linking it from the store.
+
+        The copy has the mode and modification time of `source`.
+        """
+        utils.ensure_file_directory_exists(destination)
+        device = self._get_device(destination)
+        if self._is_linkable(device):
+            source_stat = os.stat(source)
+            data = utils.get_bytes(source)
+            mode = stat.S_IMODE(source_stat.st_mode)
+            blob = self._get_blob_path(
+                f"{get_digest(data)}-{mode:o}-{source_stat.st_mtime_ns}"
+            )
+            times = (source_stat.st_atime_ns, source_stat.st_mtime_ns)
+            if self._link(blob, destination, data, device, mode=mode, times=times):
+                return
+        utils.copy_file(source, destination)
+        self.stats.add("store_link_fallbacks")
+
+    def prune(self):
+        """Remove all blobs which are not linked from anywhere else."""
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.startswith(_TEMP_PREFIX):
+                    continue
+                blob = os.path.join(dirpath, filename)
+                try:
+                    if os.stat(blob).st_nlink == 1:
+                        os.unlink(blob)
+                        self.stats.add("store_blobs_pruned")
+                except FileNotFoundError:
+                    pass
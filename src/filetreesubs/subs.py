@@ -36,11 +36,11 @@ import sys
 
 import doit.tools
 
-from filetreesubs import utils
+from filetreesubs import compress, journal, pipeline, store, utils
 
 
 class FileTreeSubs:
-    # pylint:disable=too-few-public-methods
+    # pylint:disable=too-few-public-methods,too-many-instance-attributes
     """Keeps track of all settings and data, and generates tasks."""
 
     # Default configuration
@@ -52,48 +52,218 @@ class FileTreeSubs:
     create_index_content = ""
     doit_config_update = {}
     encoding = "utf-8"
+    io_pipeline_config = None
+    compress_config = None
+    store_path = None
+    path_filter = None
+    journal_config = None
+    print_stats = False
 
-    # Internal vars
-    substitutes_filenames = {}
-    substitutes_original_filenames = set()
-    substitutes_content = {}
-    substitutes_content_config = {}
+    def __init__(self, content_cache=None):
+        # Internal vars
+        self.substitutes_filenames = {}
+        self.substitutes_original_filenames = set()
+        self.substitutes_content = {}
+        self.substitutes_content_config = {}
+        self.content_cache = content_cache
+        self.stats = utils.Statistics()
+        self.io_pipeline = None
+        self.compressor = None
+        self.store = None
+        self.journal = None
+        self._index_data = None
+        self._index_digest = None
 
-    def _do_copy(self, source, destination):
+    def _get_include_contents(self, filename):
+        """Retrieve the contents of the include file `filename`."""
+        if self.content_cache is not None:
+            return self.content_cache.get_contents(filename, encoding=self.encoding)
+        return utils.get_contents(filename, encoding=self.encoding)
+
+    def _get_io_pipeline(self):
+        """Return the I/O pipeline, or `None` if it is not enabled."""
+        if self.io_pipeline is None and self.io_pipeline_config is not None:
+            self.io_pipeline = pipeline.IOPipeline(
+                stats=self.stats,
+                write_bytes=self._write_output,
+                copy_file=self._copy_output,
+                remove_file=self._remove_output,
+                **self.io_pipeline_config,  # pylint:disable=not-a-mapping
+            )
+        return self.io_pipeline
+
+    def _get_compressor(self):
+        """Return the sidecar compressor, or `None` if it is not enabled."""
+        if self.compressor is None and self.compress_config is not None:
+            self.compressor = compress.Compressor(
+                stats=self.stats,
+                journal=self._get_journal(),
+                **self.compress_config,  # pylint:disable=not-a-mapping
+            )
+        return self.compressor
+
+    def _get_store(self):
+        """Return the content-addressed store, or `None` if it is not enabled."""
+        if self.store is None and self.store_path is not None:
+            self.store = store.ContentStore(self.store_path, stats=self.stats)
+        return self.store
+
+    def _get_journal(self):
+        """Return the change journal, or `None` if it is not enabled."""
+        if self.journal is None and self.journal_config is not None:
+            self.journal = journal.Journal(
+                root=self.destination,
+                stats=self.stats,
+                **self.journal_config,  # pylint:disable=not-a-mapping
+            )
+        return self.journal
+
+    def _write_output(self, destination, data):
+        """Write `data` to the output file `destination`."""
+        change_journal = self._get_journal()
+        existed = change_journal is not None and os.path.lexists(destination)
+        content_store = self._get_store()
+        if content_store is not None:
+            content_store.write_bytes(destination, data)
+        else:
+            utils.write_bytes(destination, data)
+        if change_journal is not None:
+            change_journal.record_write(destination, data, existed)
+
+    def _copy_output(self, source, destination):
+        """Copy `source` to the output file `destination`."""
+        change_journal = self._get_journal()
+        existed = change_journal is not None and os.path.lexists(destination)
+        content_store = self._get_store()
+        if content_store is not None:
+            content_store.copy_file(source, destination)
+        else:
+            utils.copy_file(source, destination)
+        if change_journal is not None:
+            change_journal.record_write(destination, None, existed)
+
+    def _remove_output(self, filename):
+        """Remove the output file `filename`."""
+        os.unlink(filename)
+        change_journal = self._get_journal()
+        if change_journal is not None:
+            change_journal.record_delete(filename)
+
+    def _get_on_written(self, stat, compress_formats):
+        """Return a callback for the I/O pipeline called for every written file.
+
+        It counts the file in the statistics `stat`, and creates compressed
+        sidecars of the formats `compress_formats`.
+        """
+        compressor = self._get_compressor() if compress_formats else None
+
+        def on_written(filename, data):
+            self.stats.add(stat)
+            if compressor is not None:
+                compressor.compress(filename, compress_formats, data)
+
+        return on_written
+
+    def close(self):
+        """Finish all pending I/O. Returns `False` if errors occurred."""
+        errors = []
+        # The I/O pipeline must be closed first, since it can create sidecars
+        if self.io_pipeline is not None:
+            errors.extend(self.io_pipeline.close())
+        if self.compressor is not None:
+            errors.extend(self.compressor.close())
+        if self.journal is not None:
+            self.journal.close()
+        # Remove blobs no longer used, for example by files changed in this run
+        if self.store_path is not None:
+            self._get_store().prune()
+        for phase, filename, exc in errors:
+            sys.stderr.write(f"Error while {phase} '{filename}': {exc}\n")
+        return not errors
+
+    def _do_copy(self, source, destination, compress_formats=()):
         """Copy file `source` to `destination`."""
-        utils.ensure_file_directory_exists(destination)
-        try:
-            os.unlink(destination)
-        except Exception:  # pylint:disable=broad-exception-caught
-            pass
-        shutil.copy2(source, destination)
+        io_pipeline = self._get_io_pipeline()
+        if io_pipeline is not None:
+            io_pipeline.submit_copy(
+                source,
+                destination,
+                on_written=self._get_on_written("files_copied", compress_formats),
+            )
+            return
+        self._copy_output(source, destination)
+        self.stats.add("files_copied")
+        if compress_formats:
+            self._get_compressor().submit(destination, compress_formats)
 
     def _do_remove(self, filename):
         """Remove file `filename`."""
         try:
-            os.unlink(filename)
+            self._remove_output(filename)
         except Exception as exc:  # pylint:disable=broad-exception-caught
             print(str(exc))
 
     def _do_remove_dir(self, filename):
         """Remove directory tree `filename`."""
+        change_journal = self._get_journal()
+        if change_journal is None:
+            shutil.rmtree(filename, True)
+            return
+        files = [
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(filename)
+            for name in names
+        ]
         shutil.rmtree(filename, True)
+        for file in files:
+            if not os.path.lexists(file):
+                change_journal.record_delete(file)
 
     def _do_createindex(self, filename):
         """Create index file at filename `filename`."""
         utils.ensure_file_directory_exists(filename)
-        utils.write_contents(
-            filename, self.create_index_content, encoding=self.encoding
-        )
+        if self._index_data is None:
+            self._index_data = self.create_index_content.encode(self.encoding)
+        change_journal = self._get_journal()
+        existed = change_journal is not None and os.path.lexists(filename)
+        content_store = self._get_store()
+        if content_store is None:
+            utils.write_bytes(filename, self._index_data)
+        else:
+            # All index files share one blob, so its digest is computed once
+            if self._index_digest is None:
+                self._index_digest = store.get_digest(self._index_data)
+            content_store.write_bytes(
+                filename, self._index_data, digest=self._index_digest
+            )
+        if change_journal is not None:
+            change_journal.record_write(filename, self._index_data, existed)
 
-    def _do_subs(self, source, destination, replace):
-        """Apply substitution `replace` for input `source` and write result to `destination`."""
-        utils.ensure_file_directory_exists(destination)
-        content = utils.get_contents(source, encoding=self.encoding)
+    def _apply_subs(self, data, replace):
+        """Apply substitution `replace` to the encoded file content `data`."""
+        content = data.decode(self.encoding)
         content = utils.substitute(
             content, {key: self.substitutes_content[key] for key in replace}
         )
-        utils.write_contents(destination, content, encoding=self.encoding)
+        return content.encode(self.encoding)
+
+    def _do_subs(self, source, destination, replace, compress_formats=()):
+        """Apply substitution `replace` for input `source` and write result to `destination`."""
+        io_pipeline = self._get_io_pipeline()
+        if io_pipeline is not None:
+            io_pipeline.submit_process(
+                source,
+                destination,
+                lambda data: self._apply_subs(data, replace),
+                on_written=self._get_on_written("files_substituted", compress_formats),
+            )
+            return
+        utils.ensure_file_directory_exists(destination)
+        data = self._apply_subs(utils.get_bytes(source), replace)
+        self._write_output(destination, data)
+        self.stats.add("files_substituted")
+        if compress_formats:
+            self._get_compressor().submit(destination, compress_formats, data)
 
     def _process_replacement(self, key, value):
         """Processes a replacement.
@@ -115,9 +285,7 @@ class FileTreeSubs:
             self.substitutes_original_filenames.add(value)
             filename = os.path.join(self.source, value)
             self.substitutes_filenames[key] = [filename]
-            self.substitutes_content[key] = utils.get_contents(
-                filename, encoding=self.encoding
-            )
+            self.substitutes_content[key] = self._get_include_contents(filename)
             return [filename]
         if "text" in value:
             self.substitutes_filenames[key] = []
@@ -125,6 +293,69 @@ class FileTreeSubs:
             return []
         raise RuntimeError(f"Cannot interpret replacement '{value}'!")
 
+    def _walk_destination(self):
+        """Walk the destination tree.
+
+        Returns the sets of relative paths of files and directories found
+        which are not excluded or preserved by `self.path_filter`. Include
+        rules are not applied.
+        """
+        destfiles = set()
+        destdirs = set()
+        keepdirs = set()
+        path_filter = self.path_filter
+        for dirpath, dirnames, filenames in os.walk(self.destination, followlinks=True):
+            path = utils.get_relname(dirpath, self.destination)
+            destdirs.add(path)
+            skipped = False
+            if path_filter is not None:
+                # Prune directories before os.walk() descends into them
+                kept = [
+                    dirname
+                    for dirname in dirnames
+                    if not path_filter.is_protected(os.path.join(path, dirname))
+                ]
+                skipped = len(kept) < len(dirnames)
+                self.stats.add("walk_pruned_directories", len(dirnames) - len(kept))
+                dirnames[:] = kept
+            for filename in filenames:
+                filename = os.path.join(path, filename)
+                # Include rules only apply to the source, so that outputs of
+                # files no longer included, sidecars and index files are removed
+                if path_filter is not None and path_filter.is_protected(filename):
+                    skipped = True
+                    continue
+                destfiles.add(filename)
+            if skipped:
+                # Directories containing skipped entries must not be removed
+                while path and path not in keepdirs:
+                    keepdirs.add(path)
+                    path = os.path.dirname(path)
+        return destfiles, destdirs - keepdirs
+
+    def _filter_source(self, path, dirnames, filenames):
+        """Apply `self.path_filter` to one directory of the source tree walk.
+
+        Prunes `dirnames` and `filenames` in-place.
+        """
+        path_filter = self.path_filter
+        kept = [
+            dirname
+            for dirname in dirnames
+            if not path_filter.is_directory_excluded(os.path.join(path, dirname))
+        ]
+        self.stats.add("walk_pruned_directories", len(dirnames) - len(kept))
+        dirnames[:] = kept
+        kept = [
+            filename
+            for filename in filenames
+            # Substitution files are never synchronized, but must be found
+            if (path == "" and filename in self.substitutes_original_filenames)
+            or not path_filter.is_file_excluded(os.path.join(path, filename))
+        ]
+        self.stats.add("walk_excluded_files", len(filenames) - len(kept))
+        filenames[:] = kept
+
     def get_tasks(self):  # noqa: C901
         # pylint:disable=too-many-locals,too-many-branches,too-many-statements
         """Generate a list of doit tasks."""
@@ -185,20 +416,26 @@ class FileTreeSubs:
         }
 
         # Walk trees to find differences
-        destfiles = set()
-        destdirs = set()
         subs_matcher = {
             re.compile(key): value for key, value in self.substitutes.items()
         }
+        # Create pipeline and compressor now, so that processes spawned by
+        # doit know that they are not running in the main process
+        self._get_io_pipeline()
+        compressor = self._get_compressor()
+        if self._get_journal() is not None:
+            self.journal.start()
+        # All index files have the same content, so they can share one check
+        create_index_uptodate = doit.tools.config_changed(
+            {"content": self.create_index_content}
+        )
         # Walk destination tree and store data in destfiles() and destdirs()
-        for dirpath, _, filenames in os.walk(self.destination, followlinks=True):
-            path = utils.get_relname(dirpath, self.destination)
-            destdirs.add(path)
-            for filename in filenames:
-                destfiles.add(os.path.join(path, filename))
+        destfiles, destdirs = self._walk_destination()
         # Walk source tree and compute differences
-        for dirpath, _, filenames in os.walk(self.source, followlinks=True):
+        for dirpath, dirnames, filenames in os.walk(self.source, followlinks=True):
             path = utils.get_relname(dirpath, self.source)
+            if self.path_filter is not None:
+                self._filter_source(path, dirnames, filenames)
             # Check whether the directory still exists
             if path in destdirs:
                 destdirs.remove(path)
@@ -217,11 +454,7 @@ class FileTreeSubs:
                     "name": dst_file,
                     "targets": [dst_file],
                     "actions": [(self._do_createindex, (dst_file,))],
-                    "uptodate": [
-                        doit.tools.config_changed(
-                            {"content": self.create_index_content}
-                        )
-                    ],
+                    "uptodate": [create_index_uptodate],
                 }
             # Special case for root: skip substitutes filenames so these files aren't copied/...
             if path == "":
@@ -234,12 +467,23 @@ class FileTreeSubs:
                         )
                         sys.exit(1)
             # Generate copy/subs tasks
+            names = set(filenames)
             for filename in sorted(filenames):
                 filename = os.path.join(path, filename)
                 if filename in destfiles:
                     destfiles.remove(filename)
                 src_file = os.path.join(self.source, filename)
                 dst_file = os.path.join(self.destination, filename)
+                targets = [dst_file]
+                compress_formats = []
+                if compressor is not None:
+                    for fmt in compressor.get_formats(filename):
+                        # Files in the source tree take precedence over sidecars
+                        if f"{os.path.basename(filename)}.{fmt}" in names:
+                            continue
+                        compress_formats.append(fmt)
+                        destfiles.discard(f"{filename}.{fmt}")
+                        targets.append(f"{dst_file}.{fmt}")
                 replaces = set()
                 for matcher, values in subs_matcher.items():
                     if matcher.match(filename):
@@ -253,16 +497,23 @@ class FileTreeSubs:
                         "basename": "subs",
                         "name": dst_file,
                         "file_dep": deps,
-                        "targets": [dst_file],
-                        "actions": [(self._do_subs, (src_file, dst_file, replaces))],
+                        "targets": targets,
+                        "actions": [
+                            (
+                                self._do_subs,
+                                (src_file, dst_file, replaces, compress_formats),
+                            )
+                        ],
                     }
                 else:
                     yield {
                         "basename": "copy",
                         "name": dst_file,
                         "file_dep": [src_file],
-                        "targets": [dst_file],
-                        "actions": [(self._do_copy, (src_file, dst_file))],
+                        "targets": targets,
+                        "actions": [
+                            (self._do_copy, (src_file, dst_file, compress_formats))
+                        ],
                     }
         # Check which files are in destination which shouldn't be there
         for filename in sorted(destfiles):
@@ -30,6 +30,8 @@ from __future__ import annotations
 
 import os
 import os.path
+import shutil
+import threading
 
 
 def makedirs(path):
@@ -85,17 +87,93 @@ def substitute(text, replacements):
     return text
 
 
+def get_bytes(filename):
+    """Retrieve the file content's as bytes."""
+    with open(filename, "rb") as file:
+        return file.read()
+
+
 def get_contents(filename, encoding="utf-8"):
     """Retrieve the file content's as a decoded string."""
-    with open(filename, "rb") as file:
-        return file.read().decode(encoding)
+    return get_bytes(filename).decode(encoding)
 
 
 def write_contents(filename, content, encoding="utf-8"):
     """Write the file content to the given string. Will use the specified encoding."""
+    write_bytes(filename, content.encode(encoding))
+
+
+def write_bytes(filename, data):
+    """Write the file content to the given bytes."""
     try:
         os.unlink(filename)
     except Exception:  # pylint:disable=broad-exception-caught
         pass
     with open(filename, "wb") as file:
-        file.write(content.encode(encoding))
+        file.write(data)
+
+
+def copy_file(source, destination):
+    """Copy file `source` to `destination`."""
+    ensure_file_directory_exists(destination)
+    try:
+        os.unlink(destination)
+    except Exception:  # pylint:disable=broad-exception-caught
+        pass
+    shutil.copy2(source, destination)
+
+
+class ContentCache:
+    # pylint:disable=too-few-public-methods
+    """Cache for decoded file contents.
+
+    Entries are keyed by the real path of the file and the encoding, and are
+    invalidated when the file's modification time or size changes. This allows
+    to share include files between several configurations run in one process.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def get_contents(self, filename, encoding="utf-8"):
+        """Retrieve the file content's as a decoded string, using the cache if possible."""
+        stat = os.stat(filename)
+        key = (os.path.realpath(filename), encoding)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        content = get_contents(filename, encoding=encoding)
+        self._cache[key] = (stamp, content)
+        return content
+
+
+class Statistics:
+    """Thread-safe collection of counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def add(self, key, value=1):
+        """Add `value` to the counter `key`."""
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def maximum(self, key, value):
+        """Set the counter `key` to `value` if that is larger than its current value."""
+        with self._lock:
+            self._values[key] = max(self._values.get(key, 0), value)
+
+    def format(self):
+        """Format all counters, one per line."""
+        with self._lock:
+            values = sorted(self._values.items())
+        return "".join(
+            (
+                f"  {key}: {value:.3f}\n"
+                if isinstance(value, float)
+                else f"  {key}: {value}\n"
+            )
+            for key, value in values
+        )
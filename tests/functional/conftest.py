@@ -0,0 +1,43 @@
+# Copyright © 2023 Felix Fontein.
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import os
+from contextlib import contextmanager
+
+import pytest
+
+from filetreesubs.__main__ import main
+
+
+@contextmanager
+def change_cwd(directory):
+    old_dir = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(old_dir)
+
+
+@pytest.fixture
+def run_main():
+    """Run filetreesubs with the given arguments in the given directory."""
+
+    def run(directory, arguments=("config.yaml",)):
+        with change_cwd(str(directory)):
+            return main(list(arguments))
+
+    return run
+
+
+@pytest.fixture
+def write_file():
+    """Write a file, creating its parent directories."""
+
+    def write(path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+    return write
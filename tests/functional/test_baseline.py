@@ -6,12 +6,9 @@ from __future__ import annotations
 import difflib
 import os
 import shutil
-from contextlib import contextmanager
 
 import pytest
 
-from filetreesubs.__main__ import main
-
 TEST_CASES = [
     (
         ["baseline-base.yaml"],
@@ -49,6 +46,38 @@ TEST_CASES = [
             ("foo/index.html", b"Some random file."),
         ],
     ),
+    (
+        ["baseline-full-pipeline.yaml"],
+        "baseline-full-pipeline.yaml",
+        "baseline-full-source",
+        "baseline-full",
+        0,
+        [
+            "sub",
+            "foo",
+            "foo/bar",
+        ],
+        [
+            ("index.html", b"Foo"),
+            ("foo/index.html", b"Some random file."),
+        ],
+    ),
+    (
+        ["baseline-full-pipeline-mp.yaml"],
+        "baseline-full-pipeline-mp.yaml",
+        "baseline-full-source",
+        "baseline-full",
+        0,
+        [
+            "sub",
+            "foo",
+            "foo/bar",
+        ],
+        [
+            ("index.html", b"Foo"),
+            ("foo/index.html", b"Some random file."),
+        ],
+    ),
 ]
 
 
@@ -113,14 +142,6 @@ def _compare_directories(source, dest):
     assert differences == 0
 
 
-@contextmanager
-def change_cwd(directory):
-    old_dir = os.getcwd()
-    os.chdir(directory)
-    yield
-    os.chdir(old_dir)
-
-
 @pytest.mark.parametrize(
     "arguments, config, source_directory, dest_directory, expected_rc, dirs_to_create, files_to_create",
     TEST_CASES,
@@ -134,6 +155,7 @@ def test_baseline(
     dirs_to_create,
     files_to_create,
     tmp_path,
+    run_main,
 ):
     tests_root = os.path.join("tests", "functional")
 
@@ -156,11 +178,71 @@ def test_baseline(
             f.write(content)
 
     # Re-build baseline
-    with change_cwd(str(tmp_path)):
-        rc = main(arguments)
+    rc = run_main(tmp_path, arguments)
     assert rc == expected_rc
 
     # Compare baseline to expected result
     source = _scan_directories(os.path.join(tests_root, dest_directory))
     dest = _scan_directories(str(tmp_path / dest_directory))
     _compare_directories(source, dest)
+
+
+BATCH_TEST_CASES = [
+    ("baseline-base.yaml", "baseline-base-source", "baseline-base"),
+    ("baseline-index.yaml", "baseline-index-source", "baseline-index"),
+    ("baseline-full.yaml", "baseline-full-source", "baseline-full"),
+]
+
+
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_batch(jobs, tmp_path, run_main):
+    tests_root = os.path.join("tests", "functional")
+
+    for config, source_directory, _ in BATCH_TEST_CASES:
+        shutil.copytree(
+            os.path.join(tests_root, source_directory),
+            tmp_path / source_directory,
+            symlinks=True,
+            ignore_dangling_symlinks=True,
+        )
+        shutil.copyfile(os.path.join(tests_root, config), tmp_path / config)
+    for path, _, files in os.walk(tmp_path):
+        if ".keep" in files:
+            os.unlink(os.path.join(path, ".keep"))
+
+    rc = run_main(tmp_path, ["--jobs", jobs, "baseline-*.yaml"])
+    assert rc == 0
+
+    for _, _, dest_directory in BATCH_TEST_CASES:
+        source = _scan_directories(os.path.join(tests_root, dest_directory))
+        dest = _scan_directories(str(tmp_path / dest_directory))
+        _compare_directories(source, dest)
+
+
+def test_batch_shared_dep_file(tmp_path, capsys, run_main):
+    tests_root = os.path.join("tests", "functional")
+
+    for config, source_directory, _ in BATCH_TEST_CASES[:2]:
+        shutil.copytree(
+            os.path.join(tests_root, source_directory),
+            tmp_path / source_directory,
+        )
+        with open(os.path.join(tests_root, config)) as f:
+            content = f.read()
+        # Use the default dependency database for all configurations
+        content = content[: content.index("doit_config:")]
+        (tmp_path / config).write_text(content)
+    for path, _, files in os.walk(tmp_path):
+        if ".keep" in files:
+            os.unlink(os.path.join(path, ".keep"))
+
+    rc = run_main(
+        tmp_path, ["--jobs", "2", "baseline-base.yaml", "baseline-index.yaml"]
+    )
+    assert rc == 0
+    assert "2 configurations use the dependency database" in capsys.readouterr().err
+
+    for _, _, dest_directory in BATCH_TEST_CASES[:2]:
+        source = _scan_directories(os.path.join(tests_root, dest_directory))
+        dest = _scan_directories(str(tmp_path / dest_directory))
+        _compare_directories(source, dest)
@@ -0,0 +1,82 @@
+# Copyright © 2023 Felix Fontein.
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import gzip
+import os
+
+import pytest
+
+CONFIG = """
+source: input
+destination: output
+substitutes:
+  '.*\\.html':
+    'INSERT_MENU':
+      file: menu.inc
+compress:
+  patterns:
+  - '.*\\.html'
+  - '.*\\.css'
+  formats:
+  - gz
+"""
+
+
+@pytest.mark.parametrize("io_pipeline", [False, True])
+def test_compress(io_pipeline, tmp_path, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(
+        CONFIG + f"io_pipeline: {'true' if io_pipeline else 'false'}\n"
+    )
+    write_file(tmp_path / "input" / "menu.inc", b"<menu>")
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU index")
+    write_file(tmp_path / "input" / "sub" / "style.css", b"body {}")
+    write_file(tmp_path / "input" / "sub" / "image.png", b"PNG")
+    write_file(tmp_path / "input" / "sub" / "page.html", b"INSERT_MENU page")
+    write_file(tmp_path / "input" / "sub" / "page.html.gz", b"not a sidecar")
+    output = tmp_path / "output"
+
+    assert run_main(tmp_path) == 0
+    assert gzip.decompress((output / "index.html.gz").read_bytes()) == (b"<menu> index")
+    assert gzip.decompress((output / "sub" / "style.css.gz").read_bytes()) == (
+        b"body {}"
+    )
+    assert not (output / "sub" / "image.png.gz").exists()
+    # Files from the source tree take precedence over sidecars
+    assert (output / "sub" / "page.html.gz").read_bytes() == b"not a sidecar"
+
+    # Unchanged files do not get their sidecars recompressed
+    mtime = (output / "index.html.gz").stat().st_mtime_ns
+    os.unlink(output / "sub" / "style.css.gz")
+    assert run_main(tmp_path) == 0
+    assert (output / "index.html.gz").stat().st_mtime_ns == mtime
+    assert (output / "sub" / "style.css.gz").exists()
+
+    # Sidecars are removed together with the original
+    os.unlink(tmp_path / "input" / "index.html")
+    assert run_main(tmp_path) == 0
+    assert not (output / "index.html").exists()
+    assert not (output / "index.html.gz").exists()
+    assert (output / "sub" / "style.css.gz").exists()
+
+
+def test_compress_defaults(tmp_path, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(
+        "source: input\ndestination: output\ncompress: true\n"
+    )
+    write_file(tmp_path / "input" / "a.html", b"a")
+    write_file(tmp_path / "input" / "b.html.gz", b"b")
+    write_file(tmp_path / "input" / "c.js", b"c")
+    write_file(tmp_path / "input" / "c.js.map", b"map")
+    output = tmp_path / "output"
+
+    assert run_main(tmp_path) == 0
+    assert sorted(os.listdir(output)) == [
+        "a.html",
+        "a.html.gz",
+        "b.html.gz",
+        "c.js",
+        "c.js.gz",
+        "c.js.map",
+    ]
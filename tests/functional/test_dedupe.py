@@ -0,0 +1,117 @@
+# Copyright © 2023 Felix Fontein.
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import errno
+import os
+
+import pytest
+
+CONFIG = """
+source: input
+destination: output
+substitutes:
+  '.*\\.html':
+    'INSERT_MENU':
+      text: '<menu>'
+create_index_filename: index.html
+create_index_content: 'Nothing to see here.'
+dedupe:
+  store: store
+"""
+
+
+def _count_blobs(store):
+    return sum(len(files) for _, _, files in os.walk(store))
+
+
+def _get_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+@pytest.mark.parametrize("io_pipeline", [False, True])
+def test_dedupe(io_pipeline, tmp_path, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(
+        CONFIG + f"io_pipeline: {'true' if io_pipeline else 'false'}\n"
+    )
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "a" / "page.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "b" / "page.html", b"INSERT_MENU!")
+    for directory, mtime in (("a", 1000000000), ("b", 1000000000), ("c", 1500000000)):
+        script = tmp_path / "input" / directory / "run.sh"
+        write_file(script, b"#!/bin/sh")
+        os.chmod(script, 0o755)
+        os.utime(script, (mtime, mtime))
+    output = tmp_path / "output"
+    store = tmp_path / "store"
+
+    assert run_main(tmp_path) == 0
+    assert (output / "index.html").read_bytes() == b"<menu>"
+    assert (output / "a" / "page.html").read_bytes() == b"<menu>"
+    assert (output / "b" / "page.html").read_bytes() == b"<menu>!"
+    for directory in ("a", "b", "c"):
+        assert (output / directory / "index.html").read_bytes() == (
+            b"Nothing to see here."
+        )
+
+    def inode(path):
+        return (output / path).stat().st_ino
+
+    assert inode("index.html") == inode("a/page.html")
+    assert inode("a/page.html") != inode("b/page.html")
+    assert inode("a/index.html") == inode("b/index.html") == inode("c/index.html")
+
+    # Generated outputs get the usual permissions of new files
+    mode = 0o666 & ~_get_umask()
+    for path in ("index.html", "b/page.html", "c/index.html"):
+        assert (output / path).stat().st_mode & 0o777 == mode
+
+    # Copies keep mode and modification time, and are only deduplicated
+    # if these are the same as well
+    assert inode("a/run.sh") == inode("b/run.sh")
+    assert inode("a/run.sh") != inode("c/run.sh")
+    for directory, mtime in (("a", 1000000000), ("b", 1000000000), ("c", 1500000000)):
+        stat = (output / directory / "run.sh").stat()
+        assert stat.st_mode & 0o777 == 0o755
+        assert stat.st_mtime == mtime
+
+    # One blob for every distinct generated content and copy
+    assert _count_blobs(store) == 5
+
+    # Changing one output must not change the others, and blobs of
+    # superseded contents are removed
+    write_file(tmp_path / "input" / "a" / "page.html", b"INSERT_MENU?")
+    write_file(tmp_path / "input" / "b" / "page.html", b"INSERT_MENU?")
+    assert run_main(tmp_path) == 0
+    assert (output / "a" / "page.html").read_bytes() == b"<menu>?"
+    assert (output / "b" / "page.html").read_bytes() == b"<menu>?"
+    assert (output / "index.html").read_bytes() == b"<menu>"
+    assert inode("a/page.html") == inode("b/page.html")
+    assert _count_blobs(store) == 5
+
+
+def test_dedupe_unlinkable(tmp_path, capsys, monkeypatch, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(CONFIG + "stats: true\n")
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "a" / "page.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "a" / "logo.png", b"PNG")
+
+    def link(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src, None, dst)
+
+    # Behave as if the store was on a different filesystem
+    monkeypatch.setattr(os, "link", link)
+    assert run_main(tmp_path) == 0
+    output = tmp_path / "output"
+    assert (output / "index.html").read_bytes() == b"<menu>"
+    assert (output / "a" / "page.html").read_bytes() == b"<menu>"
+    assert (output / "a" / "logo.png").read_bytes() == b"PNG"
+    assert (output / "a" / "index.html").read_bytes() == b"Nothing to see here."
+    # Only the first output was written to the store, all others directly
+    err = capsys.readouterr().err
+    assert "  store_blobs_written: 1\n" in err
+    assert "  store_link_fallbacks: 4\n" in err
+    assert _count_blobs(tmp_path / "store") == 0
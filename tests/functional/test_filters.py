@@ -0,0 +1,84 @@
+# Copyright © 2023 Felix Fontein.
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import os
+
+CONFIG = """
+source: input
+destination: output
+substitutes:
+  '.*\\.html':
+    'INSERT_MENU':
+      file: menu.inc
+exclude:
+- '(.*/)?\\.git'
+- glob: '*.tmp'
+include:
+- '.*\\.html'
+- '.*\\.css'
+preserve:
+- '\\.well-known'
+- 'gone/keep\\.txt'
+"""
+
+
+def test_filters(tmp_path, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(CONFIG)
+    write_file(tmp_path / "input" / "menu.inc", b"<menu>")
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "style.css", b"body {}")
+    write_file(tmp_path / "input" / "notes.md", b"not included")
+    write_file(tmp_path / "input" / ".git" / "index.html", b"excluded directory")
+    write_file(tmp_path / "input" / "sub" / ".git" / "HEAD", b"excluded directory")
+    write_file(tmp_path / "input" / "sub" / "page.html", b"page")
+    write_file(tmp_path / "input" / "sub" / "cache.html.tmp", b"excluded file")
+    output = tmp_path / "output"
+    write_file(output / ".well-known" / "security.txt", b"preserved")
+    write_file(output / "gone" / "keep.txt", b"preserved")
+    write_file(output / "gone" / "remove.html", b"removed")
+    write_file(output / "removed.html", b"removed")
+
+    assert run_main(tmp_path) == 0
+
+    result = set()
+    for dirpath, _, filenames in os.walk(output):
+        for filename in filenames:
+            result.add(os.path.relpath(os.path.join(dirpath, filename), output))
+    assert result == {
+        os.path.join(".well-known", "security.txt"),
+        os.path.join("gone", "keep.txt"),
+        "index.html",
+        "style.css",
+        os.path.join("sub", "page.html"),
+    }
+    assert (output / "index.html").read_bytes() == b"<menu>"
+
+
+def test_filters_include_generated(tmp_path, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(
+        "source: input\n"
+        "destination: output\n"
+        "include:\n"
+        "- '[^/]*\\.html'\n"
+        "- 'sub/.*\\.css'\n"
+        "compress: true\n"
+        "create_index_filename: index.html\n"
+    )
+    write_file(tmp_path / "input" / "a.html", b"a")
+    write_file(tmp_path / "input" / "b.html", b"b")
+    write_file(tmp_path / "input" / "sub" / "style.css", b"body {}")
+    output = tmp_path / "output"
+
+    assert run_main(tmp_path) == 0
+    assert (output / "a.html.gz").exists()
+    assert (output / "sub" / "style.css.gz").exists()
+    assert (output / "sub" / "index.html").exists()
+
+    # Sidecars and index files are removed although include does not match them
+    os.unlink(tmp_path / "input" / "a.html")
+    os.unlink(tmp_path / "input" / "sub" / "style.css")
+    os.rmdir(tmp_path / "input" / "sub")
+    assert run_main(tmp_path) == 0
+    assert sorted(os.listdir(output)) == ["b.html", "b.html.gz", "index.html"]
@@ -0,0 +1,94 @@
+# Copyright © 2023 Felix Fontein.
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+CONFIG = """
+source: input
+destination: output
+substitutes:
+  '.*\\.html':
+    'INSERT_MENU':
+      text: '<menu>'
+create_index_filename: index.html
+create_index_content: 'Nothing to see here.'
+compress:
+  patterns:
+  - '.*\\.html'
+"""
+
+
+def _read_journal(tmp_path):
+    with open(tmp_path / "changes.jsonl", "rb") as f:
+        return sorted(
+            (
+                (entry["action"], entry["path"], entry["size"], entry["digest"])
+                for entry in (json.loads(line) for line in f)
+            ),
+            key=lambda entry: entry[1],
+        )
+
+
+def _digest(data):
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def test_journal(tmp_path, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(CONFIG + "journal: changes.jsonl\n")
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "logo.png", b"PNG")
+    write_file(tmp_path / "input" / "sub" / "image.png", b"PNG")
+    output = tmp_path / "output"
+
+    assert run_main(tmp_path) == 0
+    gz = (output / "index.html.gz").read_bytes()
+    assert _read_journal(tmp_path) == [
+        ("created", "index.html", 6, _digest(b"<menu>")),
+        ("created", "index.html.gz", len(gz), _digest(gz)),
+        ("created", "logo.png", 3, _digest(b"PNG")),
+        ("created", os.path.join("sub", "image.png"), 3, _digest(b"PNG")),
+        (
+            "created",
+            os.path.join("sub", "index.html"),
+            20,
+            _digest(b"Nothing to see here."),
+        ),
+    ]
+
+    # Nothing changed
+    assert run_main(tmp_path) == 0
+    assert _read_journal(tmp_path) == []
+
+    # Modify and delete files
+    write_file(tmp_path / "input" / "logo.png", b"JPEG")
+    os.unlink(tmp_path / "input" / "sub" / "image.png")
+    os.rmdir(tmp_path / "input" / "sub")
+    assert run_main(tmp_path) == 0
+    assert _read_journal(tmp_path) == [
+        ("modified", "logo.png", 4, _digest(b"JPEG")),
+        ("deleted", os.path.join("sub", "image.png"), None, None),
+        ("deleted", os.path.join("sub", "index.html"), None, None),
+    ]
+
+
+def test_journal_nul(tmp_path, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(
+        CONFIG + "journal:\n  path: changes.lst\n  format: nul\n"
+    )
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "sub" / "image.png", b"PNG")
+
+    assert run_main(tmp_path) == 0
+    with open(tmp_path / "changes.lst", "rb") as f:
+        paths = f.read().split(b"\0")
+    assert paths[-1] == b""
+    assert sorted(paths[:-1]) == [
+        b"index.html",
+        b"index.html.gz",
+        os.path.join("sub", "image.png").encode(),
+        os.path.join("sub", "index.html").encode(),
+    ]
@@ -0,0 +1,73 @@
+# Copyright © 2023 Felix Fontein.
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+CONFIG = """
+source: input
+destination: output
+substitutes:
+  '.*\\.html':
+    'INSERT_MENU':
+      text: '<menu>'
+stats: true
+"""
+
+
+@pytest.mark.parametrize("io_pipeline", [False, True])
+def test_stats(io_pipeline, tmp_path, capsys, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(
+        CONFIG + f"io_pipeline: {'true' if io_pipeline else 'false'}\n"
+    )
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "logo.png", b"PNG")
+
+    assert run_main(tmp_path) == 0
+    assert (tmp_path / "output" / "index.html").read_bytes() == b"<menu>"
+    err = capsys.readouterr().err
+    assert "Statistics:\n" in err
+    assert "  files_copied: 1\n" in err
+    assert "  files_substituted: 1\n" in err
+    assert "  elapsed_seconds: " in err
+    if io_pipeline:
+        assert "  io_bytes_read: 11\n" in err
+        assert "  io_bytes_written: 9\n" in err
+
+
+@pytest.mark.parametrize("io_pipeline", [False, True])
+def test_subs_error(io_pipeline, tmp_path, capsys, run_main, write_file):
+    (tmp_path / "config.yaml").write_text(
+        CONFIG
+        + f"io_pipeline: {'true' if io_pipeline else 'false'}\n"
+        + "journal: changes.jsonl\n"
+    )
+    write_file(tmp_path / "input" / "index.html", b"INSERT_MENU")
+    write_file(tmp_path / "input" / "broken.html", b"\xff INSERT_MENU")
+    output = tmp_path / "output"
+    write_file(output / "broken.html", b"old content")
+
+    rc = run_main(tmp_path)
+    err = capsys.readouterr().err
+    if io_pipeline:
+        assert rc == 1
+        # The pipeline reports the failing phase, removes the target, and
+        # continues with the other files
+        assert "Error while processing '" in err
+        assert not (output / "broken.html").exists()
+        assert (output / "index.html").read_bytes() == b"<menu>"
+        assert "  files_substituted: 1\n" in err
+        # The removal is recorded in the journal
+        with open(tmp_path / "changes.jsonl", "rb") as f:
+            entries = sorted(
+                (entry["action"], entry["path"]) for entry in map(json.loads, f)
+            )
+        assert entries == [("created", "index.html"), ("deleted", "broken.html")]
+    else:
+        # doit reports the failed task and stops
+        assert rc == 2
+        assert "UnicodeDecodeError" in err
+        assert "files_substituted" not in err